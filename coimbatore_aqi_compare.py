@@ -1,114 +1,265 @@
 # coimbatore_aqi_compare.py
 # Fetches AQI & pollutant data (IQAir + AQI.in) for Coimbatore,
-# computes an average AQI, appends one clean row per run to aqi_compare.csv,
-# and prints the absolute path where the CSV is saved (useful for GitHub Actions).
+# computes an average AQI, appends one clean JSON line per run to aqi_compare.ndjson,
+# and prints the absolute path where the file is saved (useful for GitHub Actions).
 
 import re
-import csv
 import os
+import time
+import hashlib
+import orjson
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+import lxml.etree
 from datetime import datetime
 
-CSV_PATH = "aqi_compare.csv"  # MUST be repository-root relative
+try:
+    import re2  # google-re2: linear-time DFA matching, no backtracking
+except ImportError:
+    re2 = None
+
+try:
+    import hyperscan  # optional: SIMD multi-pattern scanning, worth it for batch backfills
+except ImportError:
+    hyperscan = None
+
+DATA_PATH = "aqi_compare.ndjson"  # MUST be repository-root relative
+CACHE_DIR = ".cache"  # extracted page text, keyed by URL hash
+CACHE_TTL = 30 * 60  # seconds; both sites refresh roughly hourly
+# (the cache only helps local / repeated runs: each scheduled Actions run starts on a fresh runner)
+MAX_TEXT_CHARS = 65536  # AQI banner + pollutant readings sit near the top; skip nav/footer text
+CHALLENGE_PAGE_CHARS = 2048  # pages shorter than this without an AQI are cookie walls / errors
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
                   "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
     "Accept-Language": "en-US,en;q=0.9",
+    "Accept-Encoding": "gzip, br",  # br is decoded by urllib3 when brotli is installed
     "Referer": "https://www.google.com/"
 }
 
-# --- simple pollutant patterns (captures numeric values) ---
+# one shared session: reuses the connection pool and TLS setup, retries transient failures
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4,
+                                      max_retries=Retry(total=2, backoff_factor=0.3)))
+
+# lxml HTML parser settings; comments/PIs are dropped while parsing so the tree stays small.
+# A fresh feed parser is built per fetch since the two concurrent fetches can't share one.
+PARSER_OPTIONS = {"recover": True, "remove_comments": True, "remove_pis": True}
+
+# --- simple pollutant patterns (captures numeric values), compiled once at import ---
+# all patterns are upper-case and run against upper-cased page text, so no IGNORECASE
 PATTERNS = {
-    "pm25": [r'PM\s*2\.?5\s*[:\u00A0]?\s*([0-9]+(?:\.[0-9]+)?)', r'PM25\s*[:\u00A0]?\s*([0-9]+(?:\.[0-9]+)?)'],
-    "pm10": [r'PM\s*10\s*[:\u00A0]?\s*([0-9]+(?:\.[0-9]+)?)', r'PM10\s*[:\u00A0]?\s*([0-9]+(?:\.[0-9]+)?)'],
-    "co":   [r'CO\s*[:\u00A0]?\s*([0-9]+(?:\.[0-9]+)?)'],
-    "so2":  [r'SO2\s*[:\u00A0]?\s*([0-9]+(?:\.[0-9]+)?)', r'SO\s*2\s*[:\u00A0]?\s*([0-9]+(?:\.[0-9]+)?)'],
-    "no2":  [r'NO2\s*[:\u00A0]?\s*([0-9]+(?:\.[0-9]+)?)', r'NO\s*2\s*[:\u00A0]?\s*([0-9]+(?:\.[0-9]+)?)'],
-    "o3":   [r'O3\s*[:\u00A0]?\s*([0-9]+(?:\.[0-9]+)?)', r'Ozone\s*[:\u00A0]?\s*([0-9]+(?:\.[0-9]+)?)']
+    "pm25": tuple(re.compile(p) for p in [r'PM\s*2\.?5\s*[:\xA0]?\s*([0-9]+(?:\.[0-9]+)?)', r'PM25\s*[:\xA0]?\s*([0-9]+(?:\.[0-9]+)?)']),
+    "pm10": tuple(re.compile(p) for p in [r'PM\s*10\s*[:\xA0]?\s*([0-9]+(?:\.[0-9]+)?)', r'PM10\s*[:\xA0]?\s*([0-9]+(?:\.[0-9]+)?)']),
+    "co":   tuple(re.compile(p) for p in [r'CO\s*[:\xA0]?\s*([0-9]+(?:\.[0-9]+)?)']),
+    "so2":  tuple(re.compile(p) for p in [r'SO2\s*[:\xA0]?\s*([0-9]+(?:\.[0-9]+)?)', r'SO\s*2\s*[:\xA0]?\s*([0-9]+(?:\.[0-9]+)?)']),
+    "no2":  tuple(re.compile(p) for p in [r'NO2\s*[:\xA0]?\s*([0-9]+(?:\.[0-9]+)?)', r'NO\s*2\s*[:\xA0]?\s*([0-9]+(?:\.[0-9]+)?)']),
+    "o3":   tuple(re.compile(p) for p in [r'O3\s*[:\xA0]?\s*([0-9]+(?:\.[0-9]+)?)', r'OZONE\s*[:\xA0]?\s*([0-9]+(?:\.[0-9]+)?)'])
 }
 
-def fetch_html(url, timeout=15):
-    resp = requests.get(url, headers=HEADERS, timeout=timeout)
-    resp.raise_for_status()
-    return resp.text
+# --- AQI detection patterns for each site ---
+IQAIR_AQI_RE = re.compile(r'(\d{1,3})\s*(?:US\s*AQI|AIR QUALITY INDEX|AQI)')
+AQIIN_AQI_RE_1 = re.compile(r'LIVE\s*AQI[\s:]*([0-9]{1,3})')
+AQIIN_AQI_RE_2 = re.compile(r'([0-9]{1,3})\s*\(AQI[- ]?US\)')
+AQIIN_AQI_RE_3 = re.compile(r'(\d{1,3})\s*(?:AQI|AQI-US|AQI \(US\))')
 
-def extract_first_number(txt, regex_list):
-    for pat in regex_list:
-        m = re.search(pat, txt, re.IGNORECASE)
-        if m:
-            try:
-                return float(m.group(1))
-            except Exception:
-                # fallback: pull any number from the matched text
-                mm = re.search(r'([0-9]+(?:\.[0-9]+)?)', m.group(0))
-                if mm:
-                    return float(mm.group(1))
+# --- all pollutant patterns fused into one alternation, scanned once per page ---
+# Only worth it under RE2: stdlib re loses its literal-prefix scan on an alternation,
+# so without RE2 the per-pattern searches are faster and COMBINED_RE stays None.
+COMBINED_RE = None
+COMBINED_GROUPS = {}
+if re2 is not None:
+    try:
+        COMBINED_RE = re2.compile("|".join(f"(?P<{k}_{i}>{p.pattern})"
+                                           for k, pats in PATTERNS.items() for i, p in enumerate(pats)))
+        # group name -> (pollutant key, index of its numeric capture group)
+        COMBINED_GROUPS = {name: (name.rsplit("_", 1)[0], idx + 1)
+                           for name, idx in COMBINED_RE.groupindex.items()}
+    except Exception:
+        COMBINED_RE = None  # pattern rejected; use the per-pattern searches
+
+# --- same pattern set as a Hyperscan database (only when hyperscan is installed) ---
+HS_PATTERNS = [(k, p) for k, pats in PATTERNS.items() for p in pats]
+HS_DB = None
+if hyperscan is not None:
+    try:
+        HS_DB = hyperscan.Database()
+        HS_DB.compile(expressions=[p.pattern.encode() for _, p in HS_PATTERNS],
+                      ids=list(range(len(HS_PATTERNS))),
+                      flags=[hyperscan.HS_FLAG_SOM_LEFTMOST | hyperscan.HS_FLAG_UTF8] * len(HS_PATTERNS))
+    except Exception:
+        HS_DB = None  # fall back to the regex scan
+
+def cache_path_for(url):
+    return os.path.join(CACHE_DIR, hashlib.sha1(url.encode()).hexdigest() + ".txt")
+
+def read_cache(url):
+    # cached page text while it is younger than CACHE_TTL, else None
+    cache_path = cache_path_for(url)
+    try:
+        if time.time() - os.path.getmtime(cache_path) < CACHE_TTL:
+            with open(cache_path, encoding="utf-8") as f:
+                return f.read()
+    except OSError:
+        pass
     return None
 
-# --- parsers for each site ---
-def parse_iqair(html):
-    soup = BeautifulSoup(html, "html.parser")
-    txt = soup.get_text(separator=" ", strip=True)
+def write_cache(url, txt):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(cache_path_for(url), "w", encoding="utf-8") as f:
+        f.write(txt)
+
+def fetch_and_parse(url, parse):
+    txt = read_cache(url)
+    if txt is not None:
+        return parse(txt)
+    txt = fetch_page_text(url)
+    result = parse(txt)
+    # only cache pages with a detected AQI, so cookie walls / challenge pages are retried
+    if result["aqi"] is not None:
+        write_cache(url, txt)
+    return result
+
+def visible_len(text):
+    # length a text node adds to page_text(): collapsed words plus one joining space
+    words = text.split() if text else None
+    return len(" ".join(words)) + 1 if words else 0
+
+def fetch_page_text(url, timeout=15):
+    # stream the body into an incremental parser, building the tree while bytes
+    # arrive, and stop downloading once there is enough visible text to scan
+    seen = 0
+    with SESSION.get(url, timeout=timeout, stream=True) as resp:
+        resp.raise_for_status()
+        # honour a charset from the Content-Type header (as resp.text did); otherwise
+        # let libxml2 detect it from the document's <meta charset>
+        declared = "charset" in resp.headers.get("Content-Type", "").lower()
+        parser = lxml.etree.HTMLPullParser(events=("end",), encoding=resp.encoding if declared else None,
+                                           **PARSER_OPTIONS)
+        for chunk in resp.iter_content(16384):
+            parser.feed(chunk)
+            for _, el in parser.read_events():
+                # mirror page_text: the element's own text (unless script/style) plus its
+                # children's tails, which are complete once the element has ended
+                if el.tag not in ("script", "style"):
+                    seen += visible_len(el.text)
+                for child in el:
+                    seen += visible_len(child.tail)
+            if seen > MAX_TEXT_CHARS:  # seen counts one joining space too many
+                break
+    return page_text(parser.close())
 
+def extract_pollutants(txt):
+    # single pass over upper-cased text; the first hit for each pollutant wins
+    if HS_DB is not None:
+        return extract_pollutants_hs(txt)
+    if COMBINED_RE is None:
+        return extract_pollutants_re(txt)
+    found = dict.fromkeys(PATTERNS)
+    missing = len(found)  # stop the sweep once every pollutant has a value
+    for m in COMBINED_RE.finditer(txt):
+        key, idx = COMBINED_GROUPS[m.lastgroup]
+        if found[key] is not None:
+            continue
+        found[key] = float(m.group(idx))
+        missing -= 1
+        if not missing:
+            break
+    return found
+
+def extract_pollutants_re(txt):
+    # stdlib re: one search per pattern; the earliest hit among a pollutant's patterns wins
+    found = dict.fromkeys(PATTERNS)
+    for key, pats in PATTERNS.items():
+        best = None
+        for pat in pats:
+            m = pat.search(txt)
+            if m and (best is None or m.start() < best.start()):
+                best = m
+        if best:
+            found[key] = float(best.group(1))
+    return found
+
+def extract_pollutants_hs(txt):
+    # Hyperscan reports where each pattern matches but not capture groups, so
+    # find the leftmost start per pattern, then read the number with the re pattern there
+    data = txt.encode()
+    starts = {}
+
+    def on_match(pid, start, end, flags, context):
+        if start < starts.get(pid, len(data)):
+            starts[pid] = start
+
+    HS_DB.scan(data, match_event_handler=on_match)
+
+    found = dict.fromkeys(PATTERNS)
+    for pid, start in sorted(starts.items(), key=lambda item: item[1]):
+        key, pat = HS_PATTERNS[pid]
+        if found[key] is not None:
+            continue
+        m = pat.match(txt, len(data[:start].decode()))  # byte offset -> str index
+        if m:
+            found[key] = float(m.group(1))
+    return found
+
+def page_text(doc):
+    # visible text of a parsed page, whitespace-collapsed, for regex scanning
+    lxml.etree.strip_elements(doc, "script", "style", with_tail=False)
+    return " ".join(" ".join(doc.itertext()).split())[:MAX_TEXT_CHARS]
+
+def empty_result():
+    return {"aqi": None, **dict.fromkeys(PATTERNS)}
+
+# --- parsers for each site ---
+def parse_iqair(txt):
+    txt = txt.upper()  # case-fold once instead of per regex
     aqi = None
-    m = re.search(r'(\d{1,3})\s*(?:US\s*AQI|Air quality index|AQI)', txt, re.IGNORECASE)
+    m = IQAIR_AQI_RE.search(txt)
     if m:
         try:
             aqi = int(m.group(1))
         except:
             aqi = None
+    if aqi is None and len(txt) < CHALLENGE_PAGE_CHARS:
+        return empty_result()
 
-    return {
-        "aqi": aqi,
-        "pm25": extract_first_number(txt, PATTERNS["pm25"]),
-        "pm10": extract_first_number(txt, PATTERNS["pm10"]),
-        "co": extract_first_number(txt, PATTERNS["co"]),
-        "so2": extract_first_number(txt, PATTERNS["so2"]),
-        "no2": extract_first_number(txt, PATTERNS["no2"]),
-        "o3": extract_first_number(txt, PATTERNS["o3"])
-    }
-
-def parse_aqi_in(html):
-    soup = BeautifulSoup(html, "html.parser")
-    txt = soup.get_text(separator=" ", strip=True)
+    return {"aqi": aqi, **extract_pollutants(txt)}
 
+def parse_aqi_in(txt):
+    txt = txt.upper()  # case-fold once instead of per regex
     aqi = None
-    m = re.search(r'Live\s*AQI[\s:]*([0-9]{1,3})', txt, re.IGNORECASE) or \
-        re.search(r'([0-9]{1,3})\s*\(AQI[- ]?US\)', txt, re.IGNORECASE) or \
-        re.search(r'(\d{1,3})\s*(?:AQI|AQI-US|AQI \(US\))', txt, re.IGNORECASE)
+    m = AQIIN_AQI_RE_1.search(txt) or \
+        AQIIN_AQI_RE_2.search(txt) or \
+        AQIIN_AQI_RE_3.search(txt)
     if m:
         try:
             aqi = int(m.group(1))
         except:
             aqi = None
+    if aqi is None and len(txt) < CHALLENGE_PAGE_CHARS:
+        return empty_result()
 
-    return {
-        "aqi": aqi,
-        "pm25": extract_first_number(txt, PATTERNS["pm25"]),
-        "pm10": extract_first_number(txt, PATTERNS["pm10"]),
-        "co": extract_first_number(txt, PATTERNS["co"]),
-        "so2": extract_first_number(txt, PATTERNS["so2"]),
-        "no2": extract_first_number(txt, PATTERNS["no2"]),
-        "o3": extract_first_number(txt, PATTERNS["o3"])
-    }
+    return {"aqi": aqi, **extract_pollutants(txt)}
 
-def summarize_and_append(iqair, aqi_in, csv_path=CSV_PATH):
-    now_iso = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def summarize_and_append(iqair, aqi_in, data_path=DATA_PATH):
+    now_iso = datetime.now().isoformat(sep=" ", timespec="seconds")
 
     # compute average from available AQIs
     aqi_vals = [v for v in (iqair.get("aqi"), aqi_in.get("aqi")) if isinstance(v, (int, float))]
-    avg = round(sum(aqi_vals)/len(aqi_vals), 1) if aqi_vals else ""
+    avg = round(sum(aqi_vals)/len(aqi_vals), 1) if aqi_vals else None
 
-    # prepare one clean row for this run
+    # prepare one clean row for this run (missing values are written as null)
     row = {
         "Timestamp": now_iso,
-        "IQAir_AQI": iqair.get("aqi") or "",
-        "IQAir_PM2.5": iqair.get("pm25") or "",
-        "IQAir_PM10": iqair.get("pm10") or "",
-        "AQIin_AQI": aqi_in.get("aqi") or "",
-        "AQIin_PM2.5": aqi_in.get("pm25") or "",
-        "AQIin_PM10": aqi_in.get("pm10") or "",
+        "IQAir_AQI": iqair.get("aqi"),
+        "IQAir_PM2.5": iqair.get("pm25"),
+        "IQAir_PM10": iqair.get("pm10"),
+        "AQIin_AQI": aqi_in.get("aqi"),
+        "AQIin_PM2.5": aqi_in.get("pm25"),
+        "AQIin_PM10": aqi_in.get("pm10"),
         "Average_AQI": avg
     }
 
@@ -118,20 +269,24 @@ def summarize_and_append(iqair, aqi_in, csv_path=CSV_PATH):
     print(f"- AQI.in: AQI={row['AQIin_AQI']}  PM2.5={row['AQIin_PM2.5']}  PM10={row['AQIin_PM10']}")
     print(f"\nAverage AQI: {row['Average_AQI']}\n")
 
-    # Make sure CSV is written to the repository working directory
+    # Make sure the data file is written to the repository working directory
     # Print absolute path for troubleshooting / GitHub Actions
-    abs_path = os.path.abspath(csv_path)
-    print("Saving CSV to:", abs_path)
+    abs_path = os.path.abspath(data_path)
+    print("Saving records to:", abs_path)
+
+    # Append one self-describing JSON line per run; no header to manage
+    with open(data_path, "ab") as f:
+        f.write(orjson.dumps(row) + b"\n")
 
-    # Append single-row-per-run, create file with header if missing
-    file_exists = os.path.exists(csv_path)
-    with open(csv_path, "a", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=list(row.keys()))
-        if not file_exists:
-            writer.writeheader()
-        writer.writerow(row)
+    print("Appended clean record to", data_path)
 
-    print("Appended clean record to", csv_path)
+def load_history(data_path=DATA_PATH):
+    # all logged runs as a DataFrame, for plotting / rolling averages.
+    # Aggregate with vectorized column ops rather than Python loops, e.g.
+    #   df[["IQAir_AQI", "AQIin_AQI"]].mean(axis=1)
+    #   df["Average_AQI"].rolling(24).mean()
+    import pandas as pd  # imported lazily: the per-run logger doesn't need it
+    return pd.read_json(data_path, lines=True, convert_dates=["Timestamp"])
 
 def main():
     urls = {
@@ -139,23 +294,26 @@ def main():
         "AQI.in": "https://www.aqi.in/dashboard/india/tamil-nadu/coimbatore"
     }
 
+    # fetch both sites concurrently (independent hosts, so the round-trips overlap)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        iqair_future = pool.submit(fetch_and_parse, urls["IQAir"], parse_iqair)
+        aqi_in_future = pool.submit(fetch_and_parse, urls["AQI.in"], parse_aqi_in)
+
     # IQAir
     try:
-        h = fetch_html(urls["IQAir"])
-        iqair = parse_iqair(h)
+        iqair = iqair_future.result()
     except Exception as e:
         print("IQAir fetch/parse error:", e)
-        iqair = {"aqi": None, "pm25": None, "pm10": None, "co": None, "so2": None, "no2": None, "o3": None}
+        iqair = empty_result()
 
     # AQI.in
     try:
-        h = fetch_html(urls["AQI.in"])
-        aqi_in = parse_aqi_in(h)
+        aqi_in = aqi_in_future.result()
     except Exception as e:
         print("AQI.in fetch/parse error:", e)
-        aqi_in = {"aqi": None, "pm25": None, "pm10": None, "co": None, "so2": None, "no2": None, "o3": None}
+        aqi_in = empty_result()
 
-    summarize_and_append(iqair, aqi_in, csv_path=CSV_PATH)
+    summarize_and_append(iqair, aqi_in, data_path=DATA_PATH)
 
 if __name__ == "__main__":
     main()